@@ -3,12 +3,19 @@
 
 from __future__ import annotations
 
+import http.client
+import io
 import json
 import os
 import re
 import sys
+import threading
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from urllib import error, request
+from functools import lru_cache
+from urllib.parse import unquote, urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass
 
 
 PLAN_LABELS = {
@@ -23,14 +30,46 @@ PLAN_TARGETS = {
     "qa-to-prod": ["prod"],
 }
 
+SUMMARY_TEMPLATE = "- Run: {run}\n- Plan: `{plan}` ({plan_label})\n- Tipo: {deploy_kind}\n"
 
-def get_env(name: str, default: str = "") -> str:
-    return os.environ.get(name, default).strip()
+# Líneas opcionales del resumen, en orden; se incluyen sólo si su clave tiene valor.
+SUMMARY_OPTIONAL_TEMPLATES = {
+    "trigger_actor": "- Triggered by: @{trigger_actor}\n",
+    "started_at": "- Started at: {started_at}\n",
+    "app_name": "- App: {app_name}\n",
+    "package_name": "- Package: {package_name}\n",
+    "git_ref": "- Ref: `{git_ref}` @ {git_sha_short}\n",
+}
+
+BASE_HEADERS = {
+    "Accept": "application/vnd.github+json",
+    "X-GitHub-Api-Version": "2022-11-28",
+}
+
+# Sin escapes \uXXXX ni espacios: el body del release lleva acentos y emojis que
+# con ensure_ascii ocupan hasta 12 bytes cada uno.
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+SANITIZE_RE = re.compile(r"[^A-Za-z0-9._-]+")
+DASH_RUN_RE = re.compile(r"-+")
+
+# Conexiones HTTP reutilizadas entre llamadas (keep-alive, una por hilo).
+THREAD_LOCAL = threading.local()
+
+# Errores de un socket keep-alive que el servidor cerró entre dos requests.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+# Redirecciones que urllib seguía en un GET (p. ej. 301 de un repo renombrado).
+REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+MAX_REDIRECTS = 5
 
 
 def sanitize(text: str) -> str:
-    clean = re.sub(r"[^A-Za-z0-9._-]+", "-", text)
-    clean = re.sub(r"-+", "-", clean).strip("-")
+    clean = DASH_RUN_RE.sub("-", SANITIZE_RE.sub("-", text)).strip("-")
     return clean or "run"
 
 
@@ -44,6 +83,91 @@ def status_icon(result: str) -> str:
     return f"{table.get(result, 'ℹ️')} {result or 'unknown'}"
 
 
+ConnectionEntry = tuple[http.client.HTTPConnection, str, dict[str, str]]
+
+
+def open_connection(scheme: str, netloc: str) -> ConnectionEntry:
+    # Respeta HTTP(S)_PROXY/NO_PROXY igual que urllib. Devuelve la conexión, el
+    # prefijo de las rutas y headers extra: HTTP vía proxy requiere URL absoluta y
+    # credenciales en cada request; HTTPS usa un túnel CONNECT.
+    if scheme == "http":
+        connection_cls = http.client.HTTPConnection
+    else:
+        connection_cls = http.client.HTTPSConnection
+    proxy = getproxies().get(scheme)
+    if not proxy or proxy_bypass(netloc):
+        return connection_cls(netloc, timeout=30), "", {}
+
+    if "://" not in proxy:
+        proxy = f"http://{proxy}"
+    proxy_parts = urlsplit(proxy)
+    proxy_netloc = proxy_parts.hostname or ""
+    if proxy_parts.port:
+        proxy_netloc = f"{proxy_netloc}:{proxy_parts.port}"
+    proxy_headers: dict[str, str] = {}
+    if proxy_parts.username:
+        credentials = f"{unquote(proxy_parts.username)}:{unquote(proxy_parts.password or '')}"
+        proxy_headers["Proxy-Authorization"] = (
+            f"Basic {b64encode(credentials.encode('utf-8')).decode('ascii')}"
+        )
+
+    if scheme == "http":
+        conn = http.client.HTTPConnection(proxy_netloc, timeout=30)
+        return conn, f"http://{netloc}", proxy_headers
+    conn = http.client.HTTPSConnection(proxy_netloc, timeout=30)
+    conn.set_tunnel(netloc, headers=proxy_headers or None)
+    return conn, "", {}
+
+
+def get_connection(scheme: str, netloc: str) -> ConnectionEntry:
+    connections = getattr(THREAD_LOCAL, "connections", None)
+    if connections is None:
+        connections = THREAD_LOCAL.connections = {}
+    key = (scheme, netloc)
+    entry = connections.get(key)
+    if entry is None:
+        entry = connections[key] = open_connection(scheme, netloc)
+    return entry
+
+
+@lru_cache(maxsize=None)
+def request_headers(token: str, with_body: bool) -> dict[str, str]:
+    # Compartidas entre llamadas: no deben modificarse in situ.
+    headers = {**BASE_HEADERS, "Authorization": f"Bearer {token}"}
+    if with_body:
+        headers["Content-Type"] = "application/json"
+    return headers
+
+
+def send_request(
+    conn: http.client.HTTPConnection,
+    method: str,
+    target: str,
+    data: bytes | None,
+    headers: dict[str, str],
+) -> tuple[http.client.HTTPResponse, bytes]:
+    if method != "GET":
+        # Un POST/PATCH no se repite (pudo haber llegado a GitHub aunque se
+        # perdiera la respuesta), así que no se envía por un socket keep-alive
+        # que el servidor pudo haber cerrado por inactividad.
+        conn.close()
+    reused = conn.sock is not None
+    while True:
+        try:
+            conn.request(method, target, body=data, headers=headers)
+            resp = conn.getresponse()
+            return resp, resp.read()
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            # Sólo se reintenta una vez, y sólo si el socket venía de otra request.
+            if not reused:
+                raise
+            reused = False
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            raise
+
+
 def github_request(
     method: str,
     endpoint: str,
@@ -52,74 +176,76 @@ def github_request(
     raise_on_404: bool = True,
 ) -> dict | None:
     api_url = os.environ.get("GITHUB_API_URL", "https://api.github.com")
-    url = f"{api_url}{endpoint}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github+json",
-        "X-GitHub-Api-Version": "2022-11-28",
-    }
-    data = None
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-        headers["Content-Type"] = "application/json"
-
-    req = request.Request(url, data=data, headers=headers, method=method)
-    try:
-        with request.urlopen(req) as resp:
-            body = resp.read()
-            return json.loads(body.decode("utf-8")) if body else {}
-    except error.HTTPError as http_err:
-        if http_err.code == 404 and not raise_on_404:
-            return None
-        detail = http_err.read().decode("utf-8", errors="replace")
+    parts = urlsplit(api_url)
+    path = f"{parts.path.rstrip('/')}{endpoint}"
+    data = None if payload is None else JSON_ENCODER.encode(payload).encode("utf-8")
+    headers = request_headers(token, data is not None)
+
+    conn, target_prefix, extra_headers = get_connection(parts.scheme, parts.netloc)
+    if extra_headers:
+        headers = {**headers, **extra_headers}
+
+    for _ in range(MAX_REDIRECTS + 1):
+        resp, body = send_request(conn, method, f"{target_prefix}{path}", data, headers)
+        location = resp.getheader("Location")
+        if method != "GET" or resp.status not in REDIRECT_STATUSES or not location:
+            break
+        # Sólo se siguen redirecciones al mismo host: el token viaja en los headers.
+        redirect = urlsplit(urljoin(f"{parts.scheme}://{parts.netloc}{path}", location))
+        if (redirect.scheme, redirect.netloc) != (parts.scheme, parts.netloc):
+            break
+        path = f"{redirect.path}?{redirect.query}" if redirect.query else redirect.path
+
+    if resp.status == 404 and not raise_on_404:
+        return None
+    if not 200 <= resp.status < 300:
+        detail = body.decode("utf-8", errors="replace")
         raise RuntimeError(
-            f"GitHub API {method} {endpoint} failed: {http_err.code} {http_err.reason} – {detail}"
-        ) from http_err
+            f"GitHub API {method} {endpoint} failed: {resp.status} {resp.reason} – {detail}"
+        )
+
+    return json.loads(body) if body else {}
 
 
 def build_release_payload() -> tuple[str, str, str, dict]:
-    token = get_env("GITHUB_TOKEN")
+    env = os.environ.copy()
+
+    def env_value(name: str, default: str = "") -> str:
+        return env.get(name, default).strip()
+
+    token = env_value("GITHUB_TOKEN")
     if not token:
         raise RuntimeError("GITHUB_TOKEN is required")
 
-    repository = get_env("GITHUB_REPOSITORY", get_env("REPOSITORY"))
+    repository = env_value("GITHUB_REPOSITORY", env_value("REPOSITORY"))
     if not repository or "/" not in repository:
         raise RuntimeError("GITHUB_REPOSITORY is not set")
 
-    deploy_kind = get_env("DEPLOY_KIND", "app")
-    plan = get_env("PLAN")
+    deploy_kind = env_value("DEPLOY_KIND", "app")
+    plan = env_value("PLAN")
     plan_label = PLAN_LABELS.get(plan, plan or "unknown plan")
-    run_id = get_env("RUN_ID")
-    run_number = get_env("RUN_NUMBER")
-    run_url = get_env("RUN_URL")
-    git_ref = get_env("GIT_REF")
-    git_sha = get_env("GIT_SHA")
-    git_ref_name = get_env("GIT_REF_NAME")
-
-    app_name = get_env("APP_NAME")
-    package_name = get_env("PACKAGE_NAME")
-
-    artifact_name = get_env("ARTIFACT_NAME")
-    artifact_dir = get_env("ARTIFACT_DIR")
-    metadata_path = get_env("METADATA_PATH")
-    package_artifact_name = get_env("PACKAGE_ARTIFACT_NAME")
-    package_file_name = get_env("PACKAGE_FILE_NAME")
-    package_status = get_env("PACKAGE_STATUS")
-    icf_status = get_env("ICF_TEMPLATE_STATUS")
-    icf_file = get_env("ICF_TEMPLATE_FILE")
-
-    promote_qa = get_env("PROMOTE_QA_RESULT", "")
-    promote_prod_after_qa = get_env("PROMOTE_PROD_AFTER_QA_RESULT", "")
-    promote_prod_from_qa = get_env("PROMOTE_PROD_FROM_QA_RESULT", "")
-
-    targets = PLAN_TARGETS.get(plan, [])
-    env_status = []
-    for target in targets:
-        if target == "qa":
-            env_status.append(f"- QA: {status_icon(promote_qa)}")
-        elif target == "prod":
-            prod_result = promote_prod_after_qa or promote_prod_from_qa
-            env_status.append(f"- Prod: {status_icon(prod_result)}")
+    run_id = env_value("RUN_ID")
+    run_number = env_value("RUN_NUMBER")
+    run_url = env_value("RUN_URL")
+    git_ref = env_value("GIT_REF")
+    git_sha = env_value("GIT_SHA")
+    git_ref_name = env_value("GIT_REF_NAME")
+
+    app_name = env_value("APP_NAME")
+    package_name = env_value("PACKAGE_NAME")
+
+    artifact_name = env_value("ARTIFACT_NAME")
+    artifact_dir = env_value("ARTIFACT_DIR")
+    metadata_path = env_value("METADATA_PATH")
+    package_artifact_name = env_value("PACKAGE_ARTIFACT_NAME")
+    package_file_name = env_value("PACKAGE_FILE_NAME")
+    package_status = env_value("PACKAGE_STATUS")
+    icf_status = env_value("ICF_TEMPLATE_STATUS")
+    icf_file = env_value("ICF_TEMPLATE_FILE")
+
+    promote_qa = env_value("PROMOTE_QA_RESULT", "")
+    promote_prod_after_qa = env_value("PROMOTE_PROD_AFTER_QA_RESULT", "")
+    promote_prod_from_qa = env_value("PROMOTE_PROD_FROM_QA_RESULT", "")
 
     tag_root = "deploy-app"
     name_suffix = plan_label
@@ -135,13 +261,11 @@ def build_release_payload() -> tuple[str, str, str, dict]:
     tag_name = f"{tag_root}-{run_id or run_number or 'run'}"
     release_name = f"{name_prefix} · {name_suffix}"
 
-    summary_lines = [
-        f"- Run: [{run_number or run_id}]({run_url})" if run_url else f"- Run: {run_number or run_id}",
-        f"- Plan: `{plan or 'unknown'}` ({plan_label})",
-        f"- Tipo: {deploy_kind}",
-    ]
-    trigger_actor = get_env("TRIGGERING_ACTOR") or get_env("TRIGGER_ACTOR") or get_env("INITIATED_BY")
-    run_started_at_raw = get_env("RUN_STARTED_AT")
+    buf = io.StringIO()
+    w = buf.write
+
+    trigger_actor = env_value("TRIGGERING_ACTOR") or env_value("TRIGGER_ACTOR") or env_value("INITIATED_BY")
+    run_started_at_raw = env_value("RUN_STARTED_AT")
 
     def format_runtime(value: str) -> str:
         if not value:
@@ -153,18 +277,34 @@ def build_release_payload() -> tuple[str, str, str, dict]:
         local_dt = dt.astimezone()
         return local_dt.strftime("%Y-%m-%d %H:%M:%S %Z")
 
-    if trigger_actor:
-        summary_lines.append(f"- Triggered by: @{trigger_actor}")
-    started_at_fmt = format_runtime(run_started_at_raw)
-    if started_at_fmt:
-        summary_lines.append(f"- Started at: {started_at_fmt}")
+    run_ref = run_number or run_id
+    summary = {
+        "run": f"[{run_ref}]({run_url})" if run_url else run_ref,
+        "plan": plan or "unknown",
+        "plan_label": plan_label,
+        "deploy_kind": deploy_kind,
+        "trigger_actor": trigger_actor,
+        "started_at": format_runtime(run_started_at_raw),
+        "app_name": app_name,
+        "package_name": package_name if deploy_kind == "package" else "",
+        "git_ref": git_ref,
+        "git_sha_short": git_sha[:7],
+    }
+    w("## Resumen\n\n")
+    w(SUMMARY_TEMPLATE.format_map(summary))
+    for key, template in SUMMARY_OPTIONAL_TEMPLATES.items():
+        if summary[key]:
+            w(template.format_map(summary))
 
-    if app_name:
-        summary_lines.append(f"- App: {app_name}")
-    if deploy_kind == "package" and package_name:
-        summary_lines.append(f"- Package: {package_name}")
-    if git_ref:
-        summary_lines.append(f"- Ref: `{git_ref}` @ {git_sha[:7] if git_sha else ''}")
+    targets = PLAN_TARGETS.get(plan, [])
+    if targets:
+        w("\n\n## Resultado por entorno\n\n")
+    for target in targets:
+        if target == "qa":
+            w(f"- QA: {status_icon(promote_qa)}\n")
+        elif target == "prod":
+            prod_result = promote_prod_after_qa or promote_prod_from_qa
+            w(f"- Prod: {status_icon(prod_result)}\n")
 
     def derive_branch(ref_name: str, ref: str) -> str:
         if ref_name:
@@ -184,81 +324,62 @@ def build_release_payload() -> tuple[str, str, str, dict]:
         cleaned = path.lstrip("./")
         return f"[{path}]({repo_url}/blob/{branch_name}/{cleaned})"
 
-    artifacts_lines = []
+    # La sección de artefactos sólo se conserva si se escribió al menos una línea.
+    artifacts_start = buf.tell()
+    w("\n\n## Artefactos\n\n")
+    artifacts_header_end = buf.tell()
     if artifact_name:
-        artifacts_lines.append(
-            f"- Export artifact: `{artifact_name}`"
-        )
+        w(f"- Export artifact: `{artifact_name}`\n")
     if artifact_dir:
-        artifacts_lines.append(
-            f"- Sandbox dir: {tree_link(artifact_dir)}"
-        )
+        w(f"- Sandbox dir: {tree_link(artifact_dir)}\n")
     if metadata_path:
-        artifacts_lines.append(
-            f"- Metadata JSON: {blob_link(metadata_path)}"
-        )
+        w(f"- Metadata JSON: {blob_link(metadata_path)}\n")
     if package_artifact_name:
-        artifacts_lines.append(
-            f"- Package artifact: `{package_artifact_name}`"
-        )
+        w(f"- Package artifact: `{package_artifact_name}`\n")
     if package_file_name:
-        package_path = (
-            f"{artifact_dir}/{package_file_name}"
-            if artifact_dir and package_file_name
-            else package_file_name
-        )
-        if artifact_dir and package_file_name:
-            artifacts_lines.append(
-                f"- Package file: {blob_link(package_path)}"
-            )
+        if artifact_dir:
+            package_path = f"{artifact_dir}/{package_file_name}"
+            w(f"- Package file: {blob_link(package_path)}\n")
         else:
-            artifacts_lines.append(f"- Package file: `{package_file_name}`")
+            w(f"- Package file: `{package_file_name}`\n")
     if package_status:
-        artifacts_lines.append(f"- Package status: {package_status}")
+        w(f"- Package status: {package_status}\n")
     if icf_status:
         detail = icf_file if icf_file else "(sin archivo)"
         if icf_file and artifact_dir:
             icf_path = f"{artifact_dir}/{icf_file}"
-            artifacts_lines.append(
-                f"- ICF template: {icf_status} {blob_link(icf_path)}"
-            )
+            w(f"- ICF template: {icf_status} {blob_link(icf_path)}\n")
         else:
-            artifacts_lines.append(f"- ICF template: {icf_status} {detail}")
+            w(f"- ICF template: {icf_status} {detail}\n")
 
     if run_url:
-        artifacts_lines.append(
-            f"- Artifacts (run): [ver en GitHub Actions]({run_url}#artifacts)"
+        w(f"- Artifacts (run): [ver en GitHub Actions]({run_url}#artifacts)\n")
+    if buf.tell() == artifacts_header_end:
+        buf.seek(artifacts_start)
+        buf.truncate()
+
+    # El release existente y las aprobaciones son GETs independientes: se
+    # consultan en paralelo para pagar un solo round-trip.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        approvals_future = executor.submit(fetch_run_approvals, token, repository, run_id)
+        existing = github_request(
+            "GET",
+            f"/repos/{repository}/releases/tags/{tag_name}",
+            token,
+            raise_on_404=False,
         )
+        approvals = approvals_future.result()
 
-    approvals = fetch_run_approvals(token, repository, run_id)
-    approvals_lines = [
-        f"- @{item['user']} ({item['state']})"
-        for item in approvals
-    ]
-
-    body_sections = [
-        "## Resumen",
-        "\n".join(summary_lines),
-    ]
-    if env_status:
-        body_sections.extend(["\n## Resultado por entorno", "\n".join(env_status)])
-    if artifacts_lines:
-        body_sections.extend(["\n## Artefactos", "\n".join(artifacts_lines)])
-    body_sections.extend([
-        "\n## Aprobaciones",
-        "\n".join(approvals_lines) if approvals_lines else "_Sin aprobaciones registradas_",
-    ])
-    body_sections.extend(
-        [
-            "\n## Resumen de cambios (completar)",
-            "_Editar este release y documentar los cambios promovidos._",
-        ]
-    )
+    w("\n\n## Aprobaciones\n\n")
+    for item in approvals:
+        w(f"- @{item['user']} ({item['state']})\n")
+    if not approvals:
+        w("_Sin aprobaciones registradas_\n")
 
-    body_sections.append(
-        "\n---\n_Generado automáticamente por GitHub Actions._"
-    )
-    body = "\n\n".join(body_sections)
+    w("\n\n## Resumen de cambios (completar)\n\n")
+    w("_Editar este release y documentar los cambios promovidos._\n")
+    w("\n\n---\n_Generado automáticamente por GitHub Actions._")
+    body = buf.getvalue()
 
     payload = {
         "tag_name": tag_name,
@@ -274,21 +395,19 @@ def build_release_payload() -> tuple[str, str, str, dict]:
         "token": token,
         "tag_name": tag_name,
     }
-    return release_name, body, tag_name, {"payload": payload, "meta": meta}
+    return (
+        release_name,
+        body,
+        tag_name,
+        {"payload": payload, "meta": meta, "existing": existing},
+    )
 
 
 def ensure_release(meta: dict) -> None:
     payload = meta["payload"]
     repository = meta["meta"]["repository"]
     token = meta["meta"]["token"]
-    tag_name = meta["meta"]["tag_name"]
-
-    existing = github_request(
-        "GET",
-        f"/repos/{repository}/releases/tags/{tag_name}",
-        token,
-        raise_on_404=False,
-    )
+    existing = meta.get("existing")
 
     if existing:
         github_request(
@@ -324,21 +443,13 @@ def fetch_run_approvals(token: str, repository: str, run_id: str) -> list[dict[s
     else:
         data = response
 
-    approvals: list[dict[str, str]] = []
-    for item in data or []:
-        if not isinstance(item, dict):
-            continue
-        user = item.get("user") or {}
-        login = user.get("login") if isinstance(user, dict) else None
-        if not login:
-            continue
-        approvals.append(
-            {
-                "user": login,
-                "state": (item.get("state") or "approved").lower(),
-            }
-        )
-    return approvals
+    return [
+        {"user": login, "state": (item.get("state") or "approved").lower()}
+        for item in data or ()
+        if isinstance(item, dict)
+        and isinstance(user := item.get("user"), dict)
+        and (login := user.get("login"))
+    ]
 
 
 def main() -> int:
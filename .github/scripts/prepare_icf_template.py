@@ -1,14 +1,27 @@
 #!/usr/bin/env python3
 """Identify and prepare ICF templates from exported artifacts."""
 
-import base64
 import json
 import os
+import re
 import sys
-import zipfile
-from collections import deque
 from pathlib import Path
 
+# Bytes leídos del inicio de cada archivo para decidir si es texto.
+TEXT_SNIFF_BYTES = 8192
+
+# Par clave=valor por línea, opcionalmente comentado con "#"; las líneas "##"
+# se ignoran y la clave no puede empezar con "#" tras quitar el comentario.
+OVERRIDE_LINE_RE = re.compile(
+    r"^[^\S\n]*(?!##)(?:#+[^\S\n]*)?([^\s#=][^=\n]*|)=(.*)$", re.MULTILINE
+)
+
+# Firmas de cabecera local, ZIP vacío y ZIP dividido.
+ZIP_MAGICS = (b"PK\x03\x04", b"PK\x05\x06", b"PK\x07\x08")
+
+# Outputs acumulados por emit_output; se escriben juntos en GITHUB_OUTPUT al final.
+PENDING_OUTPUTS: list[tuple[str, str]] = []
+
 
 def log(message: str) -> None:
     print(message, flush=True)
@@ -16,11 +29,22 @@ def log(message: str) -> None:
 
 def is_text_file(path: Path) -> bool:
     try:
-        chunk = path.read_bytes()
-        chunk.decode("utf-8")
-        return True
-    except (UnicodeDecodeError, OSError):
+        with path.open("rb") as handle:
+            head = handle.read(TEXT_SNIFF_BYTES)
+    except OSError:
+        return False
+    if b"\x00" in head:
         return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        # Un carácter multibyte puede quedar cortado al final del bloque leído.
+        return (
+            len(head) == TEXT_SNIFF_BYTES
+            and exc.reason == "unexpected end of data"
+            and exc.start >= len(head) - 3
+        )
+    return True
 
 
 def prefer_key(path: Path) -> tuple[int, int, str]:
@@ -37,55 +61,101 @@ def prefer_key(path: Path) -> tuple[int, int, str]:
 def emit_output(name: str, value: str | None) -> None:
     if not value:
         return
+    PENDING_OUTPUTS.append((name, value))
+
+
+def flush_outputs() -> None:
     output_path = os.environ.get("GITHUB_OUTPUT")
-    if not output_path:
+    if not output_path or not PENDING_OUTPUTS:
         return
     with open(output_path, "a", encoding="utf-8") as handle:
-        handle.write(f"{name}={value}\n")
-
+        handle.write("".join(f"{name}={value}\n" for name, value in PENDING_OUTPUTS))
+    PENDING_OUTPUTS.clear()
+
+
+def read_template(path: Path) -> tuple[str, bytes]:
+    raw = path.read_bytes()
+    content = raw.decode("utf-8")
+    if "\r" in content:
+        # Mismos saltos de línea que read_text() en modo universal.
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+        raw = content.encode("utf-8")
+    return content, raw
+
+
+def find_overrides_start(content: str) -> int:
+    # Las entradas comienzan tras la primera línea "##...----" de la plantilla.
+    pos = content.find("----")
+    while pos != -1:
+        line_start = content.rfind("\n", 0, pos) + 1
+        line_end = content.find("\n", pos)
+        if content[line_start:pos].lstrip().startswith("##"):
+            return len(content) if line_end == -1 else line_end + 1
+        if line_end == -1:
+            break
+        pos = content.find("----", line_end)
+    return 0
 
-def collect_candidates(root: Path) -> list[Path]:
-    candidates: list[Path] = []
 
-    if not root.exists():
-        return candidates
+def parse_overrides(content: str) -> dict[str, str]:
+    return {
+        match.group(1).rstrip(): match.group(2).strip()
+        for match in OVERRIDE_LINE_RE.finditer(content, find_overrides_start(content))
+    }
 
-    queue: deque[Path] = deque([root])
-    seen_dirs: set[Path] = set()
 
-    while queue:
-        current = queue.popleft()
-        if current in seen_dirs or not current.exists():
-            continue
-        seen_dirs.add(current)
+def looks_like_zip(path: str) -> bool:
+    try:
+        with open(path, "rb") as handle:
+            return handle.read(4) in ZIP_MAGICS
+    except OSError:
+        return False
 
-        if current.is_file():
-            continue
 
-        for entry in current.iterdir():
-            if entry.is_dir():
-                queue.append(entry)
-                continue
+def extract_zip(path: Path, target_dir: Path) -> bool:
+    # Un directorio ya extraído no se vuelve a abrir ni a descomprimir.
+    if target_dir.exists():
+        return True
 
-            if not entry.is_file():
-                continue
+    # Import diferido: sólo se paga cuando el árbol contiene algún ZIP.
+    import zipfile
 
-            if zipfile.is_zipfile(entry):
-                if entry.suffix:
-                    target_dir = entry.with_suffix("")
-                else:
-                    target_dir = entry.parent / f"{entry.name}_extracted"
-                if not target_dir.exists():
-                    log(f"Extrayendo ZIP {entry} en {target_dir}")
-                    target_dir.mkdir(parents=True, exist_ok=True)
-                    with zipfile.ZipFile(entry) as archive:
-                        archive.extractall(target_dir)
-                queue.append(target_dir)
-                continue
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        return False
+    with archive:
+        log(f"Extrayendo ZIP {path} en {target_dir}")
+        target_dir.mkdir(parents=True, exist_ok=True)
+        archive.extractall(target_dir)
+    return True
 
-            candidates.append(entry)
 
-    return candidates
+def collect_candidates(root: Path) -> list[Path]:
+    if not root.exists():
+        return []
+
+    found: list[tuple[int, str]] = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        depth = dirpath.count(os.sep)
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            # Sólo los .zip se inspeccionan como archivo comprimido; así se evita
+            # abrir cada archivo del árbol para revisar su firma. La firma descarta
+            # los falsos .zip antes de que ZipFile busque el directorio central.
+            target_name = name[:-4]
+            if name.lower().endswith(".zip") and target_name and looks_like_zip(full):
+                if extract_zip(Path(full), Path(dirpath, target_name)):
+                    # os.walk ya listó este directorio: se agrega el extraído a
+                    # mano para que también se recorra.
+                    if target_name not in dirnames:
+                        dirnames.append(target_name)
+                    continue
+            found.append((depth, full))
+
+    # Mismo orden que un recorrido por niveles: primero los archivos menos profundos.
+    found.sort(key=lambda item: item[0])
+    return [Path(full) for _, full in found]
 
 
 def main() -> int:
@@ -121,9 +191,11 @@ def main() -> int:
         ".env",
         ".txt",
     }
-    chosen: Path | None = None
+    # Las raíces de búsqueda se solapan; cada archivo se evalúa una sola vez.
     candidates = [
-        path for path in candidates if path.is_file() and is_text_file(path)
+        path
+        for path in dict.fromkeys(candidates)
+        if path.is_file() and is_text_file(path)
     ]
     prioritized = [
         path for path in candidates if path.suffix.lower() in allowed_suffixes
@@ -133,30 +205,32 @@ def main() -> int:
     else:
         candidates = []
     status = "missing"
-    if candidates:
-        chosen = sorted(candidates, key=prefer_key)[0]
-        log(f"Plantilla encontrada: {chosen}")
-        status = "ready"
-    else:
+    content: str | None = None
+    content_bytes = b""
+    source_path: str | None = None
+    if not candidates:
         log(
             "::notice::No se encontró plantilla en los artefactos descargados;"
             " el despliegue continuará sin overrides ICF."
         )
-
-    content: str | None = None
-    source_path: str | None = None
-    if chosen:
+    # Sólo se inspecciona el inicio de cada archivo al filtrar; si el mejor
+    # candidato no se puede leer completo se pasa al siguiente.
+    for chosen in sorted(candidates, key=prefer_key):
         try:
-            content = chosen.read_text(encoding="utf-8")
-            source_path = str(chosen)
-        except OSError as exc:
+            content, content_bytes = read_template(chosen)
+        except (OSError, UnicodeDecodeError) as exc:
             log(f"::notice::No se pudo leer la plantilla {chosen}: {exc}")
+            continue
+        log(f"Plantilla encontrada: {chosen}")
+        source_path = str(chosen)
+        status = "ready"
+        break
 
     if content is None and fallback_template:
         fallback = Path(fallback_template)
         if fallback.is_file():
             log(f"Usando plantilla de fallback {fallback}")
-            content = fallback.read_text(encoding="utf-8")
+            content, content_bytes = read_template(fallback)
             source_path = str(fallback)
             if status == "missing":
                 status = "fallback"
@@ -166,25 +240,9 @@ def main() -> int:
         emit_output("icf_template_status", status)
         return 0
 
-    lines = content.splitlines()
-    overrides: dict[str, str] = {}
-    start_idx = 0
-    for idx, line in enumerate(lines):
-        if line.strip().startswith("##") and "----" in line:
-            start_idx = idx + 1
-            break
-    for raw_line in lines[start_idx:]:
-        stripped = raw_line.strip()
-        if not stripped or stripped.startswith("##"):
-            continue
-        if stripped.startswith("#"):
-            stripped = stripped.lstrip("#").strip()
-        if not stripped or stripped.startswith("#") or "=" not in stripped:
-            continue
-        key, value = stripped.split("=", 1)
-        overrides[key.strip()] = value.strip()
+    overrides = parse_overrides(content)
 
-    overrides_json = json.dumps(overrides, indent=2, ensure_ascii=False)
+    overrides_json = json.dumps(overrides, indent=2, ensure_ascii=False).encode("utf-8")
 
     if not overrides:
         if status == "ready":
@@ -201,23 +259,27 @@ def main() -> int:
             " Revisa la issue automática para completar los pasos."
         )
 
-    encoded_content = base64.b64encode(content.encode("utf-8")).decode("ascii")
-    encoded_overrides = base64.b64encode(overrides_json.encode("utf-8")).decode(
-        "ascii"
-    )
+    import base64
+
+    encoded_content = base64.b64encode(content_bytes).decode("ascii")
+    encoded_overrides = base64.b64encode(overrides_json).decode("ascii")
 
     emit_output("icf_template_path", source_path)
     emit_output("icf_template_source", source_path)
     if source_path:
         emit_output("icf_template_file", Path(source_path).name)
     emit_output("icf_template_content_b64", encoded_content)
+    # Los outputs por entorno del job (qa/prod) se mapean a este mismo valor en
+    # los workflows; emitirlo una sola vez evita triplicar el blob en GITHUB_OUTPUT.
     emit_output("icf_overrides_json_b64", encoded_overrides)
-    emit_output("icf_overrides_qa_json_b64", encoded_overrides)
-    emit_output("icf_overrides_prod_json_b64", encoded_overrides)
     emit_output("icf_template_status", status)
 
     return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    try:
+        exit_code = main()
+    finally:
+        flush_outputs()
+    sys.exit(exit_code)
@@ -14,11 +14,16 @@ def get_env(name: str, default: str = "") -> str:
     return os.environ.get(name, default)
 
 
-def resolved_path(dest_dir: Path, output_value: str, fallback_name: str) -> str:
-    if not output_value:
-        return str(dest_dir / fallback_name)
-    candidate = Path(output_value)
-    return str(dest_dir / candidate.name)
+def resolved_path(dest_str: str, output_value: str, fallback_name: str) -> str:
+    # Mismo resultado que Path(dest) / Path(output_value).name: se ignora la "/"
+    # final del valor, un DEST vacío (".") no se antepone y un nombre vacío no
+    # agrega separador.
+    name = os.path.basename(output_value.rstrip("/")) if output_value else fallback_name
+    if not name:
+        return dest_str
+    if dest_str == ".":
+        return name
+    return os.path.join(dest_str, name)
 
 
 def parse_json_string(value: str, fallback: Any) -> Any:
@@ -34,26 +39,21 @@ def decode_overrides_present(encoded: str) -> bool:
     if not encoded:
         return False
     try:
-        raw = b64decode(encoded).decode("utf-8")
-        parsed = json.loads(raw)
-        if isinstance(parsed, dict):
-            return bool(parsed)
-        if isinstance(parsed, list):
-            return bool(parsed)
-        return bool(parsed)
-    except (ValueError, json.JSONDecodeError):
+        raw = b64decode(encoded).strip()
+    except ValueError:
         return False
+    # prepare_icf_template emite siempre un objeto JSON; basta con saber si tiene
+    # contenido, sin parsearlo completo. Cualquier otra cosa cuenta como ausente.
+    if (raw[:1], raw[-1:]) in ((b"{", b"}"), (b"[", b"]")):
+        return bool(raw[1:-1].strip())
+    return False
 
 
 def main() -> int:
     dest_dir = Path(get_env("DEST"))
-    metadata_path = dest_dir / "export-metadata.json"
+    dest_str = str(dest_dir)
 
     artifact_name = get_env("ARTIFACT_NAME")
-    artifact_path_output = get_env("ARTIFACT_PATH")
-    artifact_zip_name = (
-        Path(artifact_path_output).name if artifact_path_output else f"{artifact_name}.zip"
-    )
 
     database_scripts = parse_json_string(get_env("DATABASE_SCRIPTS_JSON"), [])
     downloaded_files = parse_json_string(get_env("DOWNLOADED_FILES_JSON"), [])
@@ -66,13 +66,15 @@ def main() -> int:
 
     data = {
         "artifact_name": artifact_name,
-        "artifact_path": str(dest_dir / artifact_zip_name),
-        "artifact_dir": str(dest_dir),
+        "artifact_path": resolved_path(
+            dest_str, get_env("ARTIFACT_PATH"), f"{artifact_name}.zip"
+        ),
+        "artifact_dir": dest_str,
         "manifest_path": resolved_path(
-            dest_dir, get_env("MANIFEST_PATH"), "export-manifest.json"
+            dest_str, get_env("MANIFEST_PATH"), "export-manifest.json"
         ),
         "raw_response_path": resolved_path(
-            dest_dir, get_env("RAW_RESPONSE_PATH"), "export-response.json"
+            dest_str, get_env("RAW_RESPONSE_PATH"), "export-response.json"
         ),
         "deployment_uuid": get_env("DEPLOYMENT_UUID"),
         "deployment_status": get_env("DEPLOYMENT_STATUS"),
@@ -88,7 +90,9 @@ def main() -> int:
     }
 
     dest_dir.mkdir(parents=True, exist_ok=True)
-    metadata_path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    metadata_path = os.path.join(dest_str, "export-metadata.json")
+    with open(metadata_path, "w", encoding="utf-8") as handle:
+        handle.write(json.dumps(data, indent=2))
     return 0
 
 